@@ -6,14 +6,25 @@ import matplotlib.pyplot as plt
 import numpy as np
 import torch
 import torchmetrics
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
 
 from . import general
 
+try:
+    import numba  # for JIT-compiled AP integration and IoU matching
+except ImportError:
+    numba = None
+
+_ZERO, _ONE = torch.zeros(1), torch.ones(1)  # constant ROC scores/targets, never modified in place
+_FITNESS_W = np.array([0.0, 0.0, 0.1, 0.9])  # weights for [P, R, mAP@0.5, mAP@0.5:0.95]
+_PX = np.linspace(0, 1, 1000)  # ap_per_class confidence/recall grid
+_AP_X = np.linspace(0, 1, 101)  # 101-point interp (COCO)
+
 
 def fitness(x):
     # Model fitness as a weighted combination of metrics
-    w = [0.0, 0.0, 0.1, 0.9]  # weights for [P, R, mAP@0.5, mAP@0.5:0.95]
-    return (x[:, :4] * w).sum(1)
+    return x[:, :4] @ _FITNESS_W
 
 
 def fitness_roc(x):
@@ -40,42 +51,58 @@ def ap_per_class(tp, conf, pred_cls, target_cls, plot=False, save_dir=".", names
         The average precision as computed in py-faster-rcnn.
     """
 
-    # Sort by objectness
-    i = np.argsort(-conf)
-    tp, conf, pred_cls = tp[i], conf[i], pred_cls[i]
-
     # Find unique classes
-    unique_classes = np.unique(target_cls)
+    unique_classes, nt = np.unique(target_cls, return_counts=True)
     nc = unique_classes.shape[0]  # number of classes, number of detections
 
+    # Group detections by class, dropping classes without labels (16-bit keys get NumPy's O(N) radix sort)
+    i = np.flatnonzero(np.isin(pred_cls, unique_classes))
+    ci = np.searchsorted(unique_classes, pred_cls[i])  # class index of each detection
+    i = i[np.argsort(ci.astype(np.uint16) if nc <= 2**16 else ci, kind="stable")]
+    n_p = np.bincount(ci, minlength=nc)  # number of predictions per class
+    start = n_p.cumsum() - n_p  # first detection of each class
+    ci = np.repeat(np.arange(nc), n_p)
+
+    # Sort by objectness within each class, and count the detections of each class with conf >= px
+    px, py = _PX, []  # for plotting
+    n = np.zeros((nc, 1000), dtype=np.int64)
+    for c in np.flatnonzero(n_p):
+        j = i[start[c] : start[c] + n_p[c]]  # view, sorted in place
+        k = np.argsort(conf[j])  # ascending, so px can be searched without negating either array
+        n[c] = n_p[c] - np.searchsorted(conf[j[k]], px)
+        j[:] = j[k[::-1]]
+    tp, conf = tp[i], conf[i]
+
+    # Accumulate FPs and TPs within each class with one cumsum over all classes
+    tpc = tp.cumsum(0)
+    tpc -= np.concatenate((np.zeros((1, tp.shape[1]), tpc.dtype), tpc))[start[ci]]
+    fpc = (np.arange(1, len(ci) + 1) - start[ci])[:, None] - tpc  # each detection is either a TP or an FP
+    recall = tpc / (nt[ci, None] + 1e-16)  # recall curves
+    precision = tpc / (tpc + fpc)  # precision curves
+
     # Create Precision-Recall curve and compute AP for each class
-    px, py = np.linspace(0, 1, 1000), []  # for plotting
     ap, p, r = np.zeros((nc, tp.shape[1])), np.zeros((nc, 1000)), np.zeros((nc, 1000))
-    for ci, c in enumerate(unique_classes):
-        i = pred_cls == c
-        n_l = (target_cls == c).sum()  # number of labels
-        n_p = i.sum()  # number of predictions
-
-        if n_p == 0 or n_l == 0:
-            continue
-        else:
-            # Accumulate FPs and TPs
-            fpc = (1 - tp[i]).cumsum(0)
-            tpc = tp[i].cumsum(0)
-
-            # Recall
-            recall = tpc / (n_l + 1e-16)  # recall curve
-            r[ci] = np.interp(-px, -conf[i], recall[:, 0], left=0)  # negative x, xp because xp decreases
-
-            # Precision
-            precision = tpc / (tpc + fpc)  # precision curve
-            p[ci] = np.interp(-px, -conf[i], precision[:, 0], left=1)  # p at pr_score
-
-            # AP from recall-precision curve
-            for j in range(tp.shape[1]):
-                ap[ci, j], mpre, mrec = compute_ap(recall[:, j], precision[:, j])
-                if plot and j == 0:
-                    py.append(np.interp(px, mrec, mpre))  # precision at mAP@0.5
+    if len(ci):
+        # Linear interpolation at px along each class's decreasing conf (np.interp(-px, -conf[c], ...)), one set of
+        # indices and weights shared by both curves
+        lo = np.clip(start[:, None] + n - 1, 0, len(ci) - 1)
+        hi = np.clip(start[:, None] + n, 0, len(ci) - 1)
+        xp = conf.astype(np.float64)  # decreasing within each class
+        with np.errstate(divide="ignore", invalid="ignore"):
+            w = (xp[lo] - px) / (xp[lo] - xp[hi])  # interpolation weights
+        w[(n == 0) | (n == n_p[:, None])] = 0  # outside the detections, set below or constant
+        fp = np.stack((recall[:, 0], precision[:, 0]))
+        r, p = fp[:, lo] + w * (fp[:, hi] - fp[:, lo])  # r, p at pr_score
+        r[n == 0], p[n == 0] = 0, 1  # before the first detection
+        r[n_p == 0], p[n_p == 0] = 0, 0
+
+    # AP from recall-precision curve
+    for c in np.flatnonzero(n_p):
+        i = slice(start[c], start[c] + n_p[c])
+        for j in range(tp.shape[1]):
+            ap[c, j], mpre, mrec = compute_ap(recall[i, j], precision[i, j])
+            if plot and j == 0:
+                py.append(np.interp(px, mrec, mpre))  # precision at mAP@0.5
 
     # Compute F1 (harmonic mean of precision and recall)
     f1 = 2 * p * r / (p + r + 1e-16)
@@ -98,6 +125,9 @@ def compute_ap(recall, precision):
         Average precision, precision curve, recall curve
     """
 
+    if numba is not None:  # 101-point interp (COCO) in two fused passes
+        return _compute_ap_interp(np.asarray(recall, dtype=np.float64), np.asarray(precision, dtype=np.float64))
+
     # Append sentinel values to beginning and end
     mrec = np.concatenate(([0.0], recall, [recall[-1] + 0.01]))
     mpre = np.concatenate(([1.0], precision, [0.0]))
@@ -108,8 +138,7 @@ def compute_ap(recall, precision):
     # Integrate area under curve
     method = "interp"  # methods: 'continuous', 'interp'
     if method == "interp":
-        x = np.linspace(0, 1, 101)  # 101-point interp (COCO)
-        ap = np.trapz(np.interp(x, mrec, mpre), x)  # integrate
+        ap = np.trapz(np.interp(_AP_X, mrec, mpre), _AP_X)  # integrate
     else:  # 'continuous'
         i = np.where(mrec[1:] != mrec[:-1])[0]  # points where x axis (recall) changes
         ap = np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1])  # area under curve
@@ -117,10 +146,83 @@ def compute_ap(recall, precision):
     return ap, mpre, mrec
 
 
+def _compute_ap_interp(recall, precision):
+    # compute_ap() 'interp' method without temporaries: one pass for the envelope, one for the integral
+    n = recall.shape[0]
+    mrec, mpre = np.empty(n + 2), np.empty(n + 2)
+    mrec[0], mpre[0] = 0.0, 1.0
+    for k in range(n):
+        mrec[k + 1], mpre[k + 1] = recall[k], precision[k]
+    mrec[n + 1], mpre[n + 1] = recall[n - 1] + 0.01, 0.0
+
+    # Compute the precision envelope
+    cur = 0.0
+    for k in range(n + 1, -1, -1):
+        cur = max(cur, mpre[k])
+        mpre[k] = cur
+
+    # Integrate area under curve, interpolated at 101 points (COCO) as np.interp would
+    ap, j, x0, y0 = 0.0, 0, 0.0, 0.0
+    for i in range(101):
+        x = i / 100
+        while j < n + 1 and mrec[j + 1] <= x:
+            j += 1
+        if j == n + 1 or mrec[j] == x:
+            y = mpre[j]
+        else:
+            y = (mpre[j + 1] - mpre[j]) / (mrec[j + 1] - mrec[j]) * (x - mrec[j]) + mpre[j]
+        if i:
+            ap += (x - x0) * (y + y0) / 2
+        x0, y0 = x, y
+
+    return ap, mpre, mrec
+
+
+if numba is not None:
+    _compute_ap_interp = numba.njit(cache=True)(_compute_ap_interp)
+
+
+def _iou_thresh_pairs(boxes1, boxes2, thres):
+    # Index pairs (i, j) of xyxy boxes with IoU above thres, without keeping the N x M IoU matrix (with Numba)
+    boxes1, boxes2 = boxes1.astype(np.float32, copy=False), boxes2.astype(np.float32, copy=False)  # Numba has no fp16
+    if numba is None:
+        return np.nonzero(general.box_iou(torch.from_numpy(boxes1), torch.from_numpy(boxes2)).numpy() > thres)
+    return _iou_thresh_pairs_kernel(boxes1, boxes2, thres)
+
+
+def _iou_thresh_pairs_kernel(boxes1, boxes2, thres):
+    # One pass to count the pairs, a second to fill index arrays of exactly that size
+    i_out, j_out = np.empty(0, np.int64), np.empty(0, np.int64)
+    for fill in (False, True):
+        n = 0
+        for i in range(boxes1.shape[0]):
+            x1, y1, x2, y2 = boxes1[i, 0], boxes1[i, 1], boxes1[i, 2], boxes1[i, 3]
+            area1 = (x2 - x1) * (y2 - y1)
+            for j in range(boxes2.shape[0]):
+                w = min(x2, boxes2[j, 2]) - max(x1, boxes2[j, 0])
+                h = min(y2, boxes2[j, 3]) - max(y1, boxes2[j, 1])
+                if w > 0 and h > 0:  # no overlap means IoU 0
+                    inter = w * h
+                    area2 = (boxes2[j, 2] - boxes2[j, 0]) * (boxes2[j, 3] - boxes2[j, 1])
+                    if inter / (area1 + area2 - inter) > thres:
+                        if fill:
+                            i_out[n], j_out[n] = i, j
+                        n += 1
+        if not fill:
+            i_out, j_out = np.empty(n, np.int64), np.empty(n, np.int64)
+    return i_out, j_out
+
+
+if numba is not None:
+    _iou_thresh_pairs_kernel = numba.njit(cache=True)(_iou_thresh_pairs_kernel)
+
+
 class ConfusionMatrix:
     # Updated version of https://github.com/kaanakan/object_detection_confusion_matrix
     def __init__(self, nc, conf=0.25, iou_thres=0.45):
-        self.matrix = np.zeros((nc + 1, nc + 1))
+        self.matrix_t = torch.zeros((nc + 1, nc + 1), dtype=torch.int64)  # counts, moved to self.device
+        self.device = None  # device of the latest batch, counts stay there until read through matrix
+        self._matrix = None  # cached host copy of matrix_t
         self.nc = nc  # number of classes
         self.conf = conf
         self.iou_thres = iou_thres
@@ -135,44 +237,75 @@ class ConfusionMatrix:
         Returns:
             None, updates confusion matrix accordingly
         """
+        if self.device != detections.device:
+            self.device = detections.device
+            self.matrix_t = self.matrix_t.to(self.device)
+        self._matrix = None
+        if self.device.type == "cpu":  # no sync to avoid, and a few NumPy calls beat the per-op torch overhead
+            return self._process_batch_numpy(detections, labels)
+
+        keep = detections[:, 4] > self.conf  # a weight, not a mask index, which would sync with the host
+        gt_classes = labels[:, 0].long()
+        detection_classes = detections[:, 5].long()
+        iou = general.box_iou(labels[:, 1:], detections[:, :4]).masked_fill_(~keep, 0)  # never match dropped ones
+
+        # Match each detection to its best label, then each label to its best remaining detection
+        gt_hit = torch.zeros_like(gt_classes)  # 1 for labels with a matching detection
+        rows, cols, counts = [], [], []
+        if iou.numel():
+            best_iou, best_gt = iou.max(0)  # best label of each detection
+            _, order = (best_gt.double() * 2 + best_iou).sort()  # by label, then IoU (IoU <= 1 keeps labels apart)
+            gt_sorted = best_gt[order]
+            last = torch.ones_like(gt_sorted, dtype=torch.bool)  # best candidate of each label
+            last[:-1] = gt_sorted[1:] != gt_sorted[:-1]
+            win = last & (best_iou[order] > self.iou_thres)  # a single detection per label, even on IoU ties
+            det_hit = torch.empty_like(win).scatter_(0, order, win)
+            gt_hit = torch.zeros_like(gt_classes).scatter_add_(0, gt_sorted, win.long())
+
+            rows += [gt_classes[best_gt], detection_classes]
+            cols += [detection_classes, torch.full_like(detection_classes, self.nc)]
+            counts += [det_hit.long(), (keep & ~det_hit) * gt_hit.max()]  # correct, background FN (if any match)
+        rows.append(torch.full_like(gt_classes, self.nc))
+        cols.append(gt_classes)
+        counts.append(1 - gt_hit)  # background FP
+        self.matrix_t.index_put_((torch.cat(rows), torch.cat(cols)), torch.cat(counts), accumulate=True)
+
+    def _process_batch_numpy(self, detections, labels):
+        # process_batch() for CPU tensors, counting into matrix_t through its shared NumPy view
+        detections, labels = detections.numpy(), labels.numpy()  # shared memory, no copies
         detections = detections[detections[:, 4] > self.conf]
-        gt_classes = labels[:, 0].int()
-        detection_classes = detections[:, 5].int()
-        iou = general.box_iou(labels[:, 1:], detections[:, :4])
-
-        x = torch.where(iou > self.iou_thres)
-        if x[0].shape[0]:
-            matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]), 1).cpu().numpy()
-            if x[0].shape[0] > 1:
-                matches = matches[matches[:, 2].argsort()[::-1]]
-                matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
-                matches = matches[matches[:, 2].argsort()[::-1]]
-                matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
-        else:
-            matches = np.zeros((0, 3))
-
-        n = matches.shape[0] > 0
-        m0, m1, _ = matches.transpose().astype(np.int16)
-        for i, gc in enumerate(gt_classes):
-            j = m0 == i
-            if n and sum(j) == 1:
-                self.matrix[gc, detection_classes[m1[j]]] += 1  # correct
-            else:
-                self.matrix[self.nc, gc] += 1  # background FP
-
-        if n:
-            for i, dc in enumerate(detection_classes):
-                if not any(m1 == i):
-                    self.matrix[dc, self.nc] += 1  # background FN
-
+        gt_classes = labels[:, 0].astype(int)
+        detection_classes = detections[:, 5].astype(int)
+        iou = general.box_iou(torch.from_numpy(labels[:, 1:]), torch.from_numpy(detections[:, :4])).numpy()
+
+        x = np.nonzero(iou > self.iou_thres)
+        matches = np.stack((*x, iou[x]), 1)
+        if x[0].shape[0] > 1:
+            matches = matches[matches[:, 2].argsort()[::-1]]
+            matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+            matches = matches[matches[:, 2].argsort()[::-1]]
+            matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+        m0, m1 = matches[:, :2].T.astype(int)  # matched label, detection indices (one-to-one)
+
+        gt_hit, det_hit = np.zeros(len(gt_classes), dtype=bool), np.zeros(len(detection_classes), dtype=bool)
+        gt_hit[m0], det_hit[m1] = True, True
+        fn = detection_classes[~det_hit] if len(m0) else detection_classes[:0]  # background FN (if any match)
+        rows = np.concatenate((gt_classes[m0], np.full(len(gt_classes) - len(m0), self.nc), fn))
+        cols = np.concatenate((detection_classes[m1], gt_classes[~gt_hit], np.full(len(fn), self.nc)))
+        np.add.at(self.matrix_t.numpy(), (rows, cols), 1)  # correct, background FP, background FN
+
+    @property
     def matrix(self):
-        return self.matrix
+        # Copied to the host only when read, not on every batch
+        if self._matrix is None:
+            self._matrix = self.matrix_t.to("cpu", copy=True).numpy()
+        return self._matrix
 
     def plot(self, save_dir="", names=()):
         try:
             import seaborn as sn
 
-            array = self.matrix / (self.matrix.sum(0).reshape(1, self.nc + 1) + 1e-6)  # normalize
+            array = self.matrix / (self.matrix.sum(0) + 1e-6)  # normalize columns, broadcast over rows
             array[array < 0.005] = np.nan  # don't annotate (would appear as 0.00)
 
             fig = plt.figure(figsize=(12, 9), tight_layout=True)
@@ -213,7 +346,10 @@ class OD_AUCROC:
         #     self.roc_image = torchmetrics.ROC(num_classes=nc)
         #     self.roc_image_noloc = torchmetrics.ROC(num_classes=nc)
         #     self.class_modifier = 0
+        self._pending = {}  # ROC updates buffered until the next compute, see _flush()
+        self._computed = {}  # ROC.compute() results, cached until the next update
         self.markers_in_normal_image = []
+        self._markers_sorted, self._markers_dirty = None, True  # sorted markers, cached for froc_curve
         self.nc = nc  # number of classes
         self.iou_thres = iou_thres
         self.fm_img_ths = fm_img_ths
@@ -248,62 +384,63 @@ class OD_AUCROC:
         if len(mal_detections) == 0:
             if nl == 0:
                 self.markers_in_normal_image.append(detection_probs)
-                self.roc_lesion.update(torch.Tensor([0.0]), torch.Tensor([0.0]))
-                self.roc_image.update(torch.Tensor([0.0]), torch.Tensor([0.0]))
-                self.roc_image_noloc.update(torch.Tensor([0.0]), torch.Tensor([0.0]))
+                self._markers_dirty = True
+                self._update(self.roc_lesion, _ZERO, _ZERO)
+                self._update(self.roc_image, _ZERO, _ZERO)
+                self._update(self.roc_image_noloc, _ZERO, _ZERO)
             else:
-                self.roc_lesion.update(torch.Tensor([0.0] * nl), torch.Tensor([1.0] * nl))
-                self.roc_image.update(torch.Tensor([0.0]), torch.Tensor([1.0]))
-                self.roc_image_noloc.update(torch.Tensor([0.0]), torch.Tensor([1.0]))
+                self._update(self.roc_lesion, torch.zeros(nl), torch.ones(nl))
+                self._update(self.roc_image, _ZERO, _ONE)
+                self._update(self.roc_image_noloc, _ZERO, _ONE)
             return
         else:
+            max_prob = torch.max(detection_probs, 0, keepdim=True)[0]
             if nl == 0:
                 self.markers_in_normal_image.append(detection_probs)
-                self.roc_lesion.update(torch.max(detection_probs, 0, keepdim=True)[0], torch.Tensor([0.0]))
-                self.roc_image.update(torch.max(detection_probs, 0, keepdim=True)[0], torch.Tensor([0.0]))
-                self.roc_image_noloc.update(torch.max(detection_probs, 0, keepdim=True)[0], torch.Tensor([0.0]))
+                self._markers_dirty = True
+                self._update(self.roc_lesion, max_prob, _ZERO)
+                self._update(self.roc_image, max_prob, _ZERO)
+                self._update(self.roc_image_noloc, max_prob, _ZERO)
                 return
             else:
-                self.roc_image_noloc.update(torch.max(detection_probs, 0, keepdim=True)[0], torch.Tensor([1.0]))
+                self._update(self.roc_image_noloc, max_prob, _ONE)
 
         gt_classes = mal_labels[:, 0].int() + self.class_modifier
-        detection_classes = mal_detections[:, 5].int() + self.class_modifier
-        iou = general.box_iou(mal_labels[:, 1:], mal_detections[:, :4])
-
-        x = torch.where(iou > self.iou_thres)
-        if x[0].shape[0]:
-            matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]), 1).cpu().numpy()
-            # if x[0].shape[0] > 1:
-            #     matches = matches[matches[:, 2].argsort()[::-1]]
-            #     matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
-            #     matches = matches[matches[:, 2].argsort()[::-1]]
-            #     matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
-        else:
-            matches = np.zeros((0, 3))
-
-        n = matches.shape[0] > 0
-        # m0: label indices, m1: detection indices
-        m0, m1, _ = matches.transpose().astype(np.int16)
-
-        image_best_score = torch.Tensor([0.0])
-        for i, gc in enumerate(gt_classes):
-            j = m0 == i
-            if n and sum(j) > 0 and any(detection_classes[m1[j]] == gc):
-                best_score = torch.Tensor([0.0])
-                for idc, dc in enumerate(detection_classes[m1[j]]):
-                    if dc == gc:
-                        best_score = torch.max(best_score, detection_probs[m1[j]][idc])
-                        image_best_score = torch.max(image_best_score, best_score)
-                self.roc_lesion.update(best_score, torch.Tensor([gc]))
-            else:
-                self.roc_lesion.update(torch.Tensor([0.0]), torch.Tensor([gc]))
+        gt, det = mal_labels.cpu().numpy(), mal_detections.cpu().numpy()
+
+        # Best score of a same-class detection overlapping each label (0 if none)
+        m0, m1 = _iou_thresh_pairs(gt[:, 1:], det[:, :4], self.iou_thres)  # label, detection indices
+        i = det[m1, 5] == gt[m0, 0]
+        best_score = np.zeros(nl, dtype=np.float32)
+        np.maximum.at(best_score, m0[i], det[m1[i], 4])
+        best_score = torch.from_numpy(best_score)
+        self._update(self.roc_lesion, best_score, gt_classes.cpu().float())
         # This cannot be multi-class based on image level definition
-        if nl > 0:
-            self.roc_image.update(image_best_score, torch.Tensor([1.0]))
+        self._update(self.roc_image, best_score.max().view(1), _ONE)
+
+    def _update(self, roc, preds, target):
+        # Many tiny ROC.update() calls are dominated by per-call overhead, so buffer them
+        # (keyed by id(): a torchmetrics Metric hashes its state, which changes on update)
+        self._pending.setdefault(id(roc), (roc, []))[1].append((preds, target))
+
+    def _flush(self):
+        # Apply the buffered updates as one ROC.update() per metric
+        for roc, updates in self._pending.values():
+            preds, target = zip(*updates)
+            roc.update(torch.cat(preds), torch.cat(target))
+            self._computed.pop(id(roc), None)
+        self._pending = {}
+
+    def _compute(self, roc):
+        # ROC.compute() sorts all predictions, so score() and plot() share one result per update
+        self._flush()
+        if id(roc) not in self._computed:
+            self._computed[id(roc)] = roc.compute()
+        return self._computed[id(roc)]
 
     def score(self):
         # Lesion level
-        lesion_fpr, lesion_tpr, lesion_thresholds = self.roc_lesion.compute()
+        lesion_fpr, lesion_tpr, lesion_thresholds = self._compute(self.roc_lesion)
 
         froc_lesion_tpr, froc_lesion_fm_img = self.froc_curve(lesion_tpr, lesion_thresholds)
         auc_roc_lesion = torchmetrics.functional.auc(lesion_fpr, lesion_tpr)
@@ -314,7 +451,7 @@ class OD_AUCROC:
 
         # Image level
         ## roc
-        image_fpr, image_tpr, image_thresholds = self.roc_image.compute()
+        image_fpr, image_tpr, image_thresholds = self._compute(self.roc_image)
 
         auc_roc_image = torchmetrics.functional.auc(image_fpr, image_tpr)
         froc_image_tpr, froc_image_fm_img = self.froc_curve(image_tpr, image_thresholds)
@@ -324,7 +461,7 @@ class OD_AUCROC:
         )
 
         # Image level non-local
-        image_nonlocal_frp, image_nonlocal_tpr, image_nonlocal_thresholds = self.roc_image_noloc.compute()
+        image_nonlocal_frp, image_nonlocal_tpr, image_nonlocal_thresholds = self._compute(self.roc_image_noloc)
 
         auc_roc_image_nonloc = torchmetrics.functional.auc(image_nonlocal_frp, image_nonlocal_tpr)
         froc_image_nonloc_tpr, froc_image_nonloc_fm_img = self.froc_curve(image_nonlocal_tpr, image_nonlocal_thresholds)
@@ -342,19 +479,19 @@ class OD_AUCROC:
         )
 
     def froc_curve(self, tpr, thresholds):
-        avg_fm_image_per_ths = []
         n_normal_images = len(self.markers_in_normal_image)
-        for threshold in thresholds:
-            markers = torch.cat(self.markers_in_normal_image)
-            avg_fm_image = torch.sum(markers > threshold) / n_normal_images
-            avg_fm_image_per_ths.append(avg_fm_image)
-        return tpr, torch.stack(avg_fm_image_per_ths)
+        if self._markers_dirty:  # new markers since the last sort
+            self._markers_sorted = torch.cat(self.markers_in_normal_image).sort().values
+            self._markers_dirty = False
+        markers = self._markers_sorted.to(thresholds)
+        n_markers = markers.numel() - torch.searchsorted(markers, thresholds, right=True)  # markers > threshold
+        return tpr, n_markers.float() / n_normal_images
 
     def plot(self):
 
         # plot roc curve using matplotlib
-        image_fpr, image_tpr, image_thresholds = self.roc_image.compute()
-        lesion_fpr, lesion_tpr, lesion_thresholds = self.roc_lesion.compute()
+        image_fpr, image_tpr, image_thresholds = self._compute(self.roc_image)
+        lesion_fpr, lesion_tpr, lesion_thresholds = self._compute(self.roc_lesion)
         image_roc_auc = torchmetrics.functional.auc(image_fpr, image_tpr).item()
         lesion_roc_auc = torchmetrics.functional.auc(lesion_fpr, lesion_tpr).item()
         plt.title("ROC Curve")
@@ -384,9 +521,9 @@ class OD_AUCROC:
     def print(self):
         print(
             "lesion roc auc: ",
-            self.roc_lesion.compute(),
+            self._compute(self.roc_lesion),
             "image roc auc: ",
-            self.roc_image.compute(),
+            self._compute(self.roc_image),
         )
 
 
@@ -395,13 +532,18 @@ def plot_pr_curve(px, py, ap, save_dir="pr_curve.png", names=()):
     fig, ax = plt.subplots(1, 1, figsize=(9, 6), tight_layout=True)
     py = np.stack(py, axis=1)
 
+    lines = np.stack(np.broadcast_arrays(px, py.T), -1)  # (recall, precision) line per class
     if 0 < len(names) < 21:  # display per-class legend if < 21 classes
-        for i, y in enumerate(py.T):
-            ax.plot(px, y, linewidth=1, label=f"{names[i]} {ap[i, 0]:.3f}")  # plot(recall, precision)
+        colors = [f"C{i}" for i in range(len(lines))]
+        ax.add_collection(LineCollection(lines, linewidths=1, colors=colors))
+        handles = [
+            Line2D([], [], linewidth=1, color=c, label=f"{names[i]} {ap[i, 0]:.3f}") for i, c in enumerate(colors)
+        ]
     else:
-        ax.plot(px, py, linewidth=1, color="grey")  # plot(recall, precision)
+        ax.add_collection(LineCollection(lines, linewidths=1, colors="grey"))
+        handles = []
 
-    ax.plot(
+    handles += ax.plot(
         px,
         py.mean(1),
         linewidth=3,
@@ -412,7 +554,7 @@ def plot_pr_curve(px, py, ap, save_dir="pr_curve.png", names=()):
     ax.set_ylabel("Precision")
     ax.set_xlim(0, 1)
     ax.set_ylim(0, 1)
-    plt.legend(bbox_to_anchor=(1.04, 1), loc="upper left")
+    plt.legend(handles=handles, bbox_to_anchor=(1.04, 1), loc="upper left")
     fig.savefig(Path(save_dir), dpi=250)
 
 
@@ -420,14 +562,17 @@ def plot_mc_curve(px, py, save_dir="mc_curve.png", names=(), xlabel="Confidence"
     # Metric-confidence curve
     fig, ax = plt.subplots(1, 1, figsize=(9, 6), tight_layout=True)
 
+    lines = np.stack(np.broadcast_arrays(px, py), -1)  # (confidence, metric) line per class
     if 0 < len(names) < 21:  # display per-class legend if < 21 classes
-        for i, y in enumerate(py):
-            ax.plot(px, y, linewidth=1, label=f"{names[i]}")  # plot(confidence, metric)
+        colors = [f"C{i}" for i in range(len(lines))]
+        ax.add_collection(LineCollection(lines, linewidths=1, colors=colors))
+        handles = [Line2D([], [], linewidth=1, color=c, label=f"{names[i]}") for i, c in enumerate(colors)]
     else:
-        ax.plot(px, py.T, linewidth=1, color="grey")  # plot(confidence, metric)
+        ax.add_collection(LineCollection(lines, linewidths=1, colors="grey"))
+        handles = []
 
     y = py.mean(0)
-    ax.plot(
+    handles += ax.plot(
         px,
         y,
         linewidth=3,
@@ -438,5 +583,5 @@ def plot_mc_curve(px, py, save_dir="mc_curve.png", names=(), xlabel="Confidence"
     ax.set_ylabel(ylabel)
     ax.set_xlim(0, 1)
     ax.set_ylim(0, 1)
-    plt.legend(bbox_to_anchor=(1.04, 1), loc="upper left")
+    plt.legend(handles=handles, bbox_to_anchor=(1.04, 1), loc="upper left")
     fig.savefig(Path(save_dir), dpi=250)